@@ -3,8 +3,16 @@ import pandas as pd
 import altair as alt
 from datetime import datetime, timedelta
 import numpy as np
+import threading
+import time
+from collections import OrderedDict
+from apscheduler.schedulers.background import BackgroundScheduler
 from src.agent import WaterIntakeAgent
-from src.database import log_intake, get_intake_history, get_daily_total
+from src.events import subscribe
+from src.archive import compact_intake, get_archive_cutoff, get_compaction_reports, reset_user_intake
+from src.trends import RANGES, get_intake_trend
+from src.leaderboard import REFRESH_INTERVAL_MINUTES, refresh_leaderboards, get_leaderboard, get_user_ranking
+from src.database import create_tables, log_intake, get_intake_since, get_achievements
 import sqlite3
 import os
 
@@ -70,18 +78,123 @@ def validate_intake_data(history, max_reasonable_intake=5000):
     
     return valid_data
 
+@st.cache_resource
+def init_database():
+    """Create and migrate the tables once per process instead of on every read and write"""
+    return create_tables()
+
+@st.cache_resource
+def start_background_jobs():
+    """
+    Refresh rankings and compact old intake in the background so page renders only
+    ever read. The API schedules the same compaction; the lease in compact_intake
+    makes sure only one of them runs it.
+    """
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(refresh_leaderboards, "interval", minutes=REFRESH_INTERVAL_MINUTES,
+                      next_run_time=datetime.now())
+    scheduler.add_job(compact_intake, "cron", hour=3)
+    scheduler.start()
+    return scheduler
+
+INTAKE_CATCH_UP_SECONDS = 2
+MAX_CACHED_USERS = 100
+
+@st.cache_resource
+def get_intake_cache():
+    """
+    Process-wide cache of raw intake rows per user, marked dirty by intake events.
+    Only the MAX_CACHED_USERS most recently viewed users are kept.
+    """
+    cache = {"lock": threading.Lock(), "users": OrderedDict()}
+    
+    def on_event(event):
+        if event.get("type") != "intake_logged":
+            return
+        with cache["lock"]:
+            entry = cache["users"].get(event["user_id"])
+            if entry:
+                entry["dirty"] = True
+    
+    subscribe(on_event)
+    return cache
+
+def build_entry_frame(rows, max_reasonable_intake=5000):
+    """Chart frame for (id, date, intake_ml) rows, leaving out unrealistic entries"""
+    valid = [(date_str, intake_ml) for _, date_str, intake_ml in rows if intake_ml <= max_reasonable_intake]
+    dates = pd.to_datetime([date_str for date_str, _ in valid], format="%Y-%m-%d")
+    return pd.DataFrame({
+        "Date": dates,
+        "Water_Intake_ml": [intake_ml for _, intake_ml in valid],
+        "Day": dates.day_name()
+    })
+
+def get_cached_intake_history(user_id, archive_cutoff=""):
+    """
+    Get (history, frame) for a user without re-reading the whole table.
+    Only ids past the last one seen are fetched, and get_intake_since is the only
+    place last_id moves, so rows logged by other processes (e.g. the API) are never
+    skipped. New rows are prepended to the history and appended to the chart frame,
+    so neither is rebuilt. Intake events from this process force that fetch right
+    away; otherwise it runs at most every INTAKE_CATCH_UP_SECONDS. Rows dated before
+    archive_cutoff are dropped as soon as a compaction moves it forward.
+    """
+    cache = get_intake_cache()
+    with cache["lock"]:
+        users = cache["users"]
+        entry = users.get(user_id)
+        if entry is None:
+            entry = users[user_id] = {
+                "last_id": 0, "history": [], "frame": None, "cutoff": archive_cutoff, "dirty": True, "checked_at": 0
+            }
+            while len(users) > MAX_CACHED_USERS:
+                users.popitem(last=False)
+        users.move_to_end(user_id)
+        
+        if archive_cutoff > entry["cutoff"]:
+            # Compaction moved these rows to the archive database
+            entry["cutoff"] = archive_cutoff
+            entry["history"] = [row for row in entry["history"] if row[0] >= archive_cutoff]
+            if entry["frame"] is not None:
+                frame = entry["frame"]
+                entry["frame"] = frame[frame["Date"] >= pd.Timestamp(archive_cutoff)].reset_index(drop=True)
+        
+        if not entry["dirty"] and time.monotonic() - entry["checked_at"] < INTAKE_CATCH_UP_SECONDS:
+            return entry["history"], entry["frame"]
+        
+        entry["dirty"] = False
+        entry["checked_at"] = time.monotonic()
+        new_rows = get_intake_since(user_id, entry["last_id"])
+        if new_rows:
+            entry["last_id"] = new_rows[-1][0]
+            # Newest entry first, like get_intake_history (log_intake stamps today's
+            # date, so id order is date order)
+            entry["history"] = [(date_str, intake_ml) for _, date_str, intake_ml in reversed(new_rows)] + entry["history"]
+        
+        if entry["frame"] is None:
+            entry["frame"] = build_entry_frame(new_rows)
+        elif new_rows:
+            entry["frame"] = pd.concat([entry["frame"], build_entry_frame(new_rows)], ignore_index=True)
+        return entry["history"], entry["frame"]
+
+def invalidate_intake_cache(user_id):
+    """Drop a user's cached rows after they were deleted from the database"""
+    cache = get_intake_cache()
+    with cache["lock"]:
+        cache["users"].pop(user_id, None)
+
 def get_validated_intake_history(user_id):
     """Get intake history with data validation"""
-    history = get_intake_history(user_id)
+    history, _ = get_cached_intake_history(user_id)
     return validate_intake_data(history)
 
-def get_validated_daily_total(user_id, date=None):
+def get_validated_daily_total(user_id, date=None, valid_history=None):
     """Get daily total with data validation"""
     if date is None:
         date = datetime.today().strftime('%Y-%m-%d')
     
-    history = get_intake_history(user_id)
-    valid_history = validate_intake_data(history)
+    if valid_history is None:
+        valid_history = get_validated_intake_history(user_id)
     
     # Calculate total for today from validated data only
     today_total = 0
@@ -91,6 +204,27 @@ def get_validated_daily_total(user_id, date=None):
     
     return min(today_total, 10000)  # Cap at 10L per day maximum
 
+def build_trend_chart(trend):
+    """Daily totals as a line, or the bucket mean over a min/max band for resampled ranges"""
+    points = pd.DataFrame(trend["points"])
+    points["Date"] = pd.to_datetime(points["date"])
+    y_axis = alt.Y('mean_ml:Q', scale=alt.Scale(domain=[0, 5000]), title="Water Intake (ml)")
+    base = alt.Chart(points).encode(x='Date:T')
+    
+    if trend["bucket"] == "day":
+        chart = base.mark_line(point=True).encode(y=y_axis, tooltip=['Date', 'mean_ml'])
+    else:
+        band = base.mark_area(opacity=0.3).encode(y='min_ml:Q', y2='max_ml:Q')
+        line = base.mark_line(point=True).encode(
+            y=y_axis,
+            tooltip=['Date', 'min_ml', 'mean_ml', 'max_ml', 'days']
+        )
+        chart = band + line
+    
+    # Add goal line
+    goal_line = alt.Chart(pd.DataFrame({'y': [2000]})).mark_rule(color='red', strokeDash=[5,5]).encode(y='y:Q')
+    return (chart + goal_line).properties(width=600, height=400)
+
 def cleanup_unrealistic_data(user_id, max_reasonable_intake=5000):
     """Remove unrealistic data entries from database"""
     conn = sqlite3.connect(DB_NAME)
@@ -104,6 +238,7 @@ def cleanup_unrealistic_data(user_id, max_reasonable_intake=5000):
         )
         deleted_count = cursor.rowcount
         conn.commit()
+        invalidate_intake_cache(user_id)
         
         if deleted_count > 0:
             st.success(f"🧹 Cleaned up {deleted_count} unrealistic entries!")
@@ -117,26 +252,18 @@ def cleanup_unrealistic_data(user_id, max_reasonable_intake=5000):
 
 def reset_user_data(user_id):
     """Completely reset user data"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+    # Raw rows, archived rows and rollups go in one transaction
+    deleted_count = reset_user_intake(user_id)
+    invalidate_intake_cache(user_id)
     
-    try:
-        cursor.execute(
-            "DELETE FROM water_intake WHERE user_id = ?",
-            (user_id,)
-        )
-        deleted_count = cursor.rowcount
-        conn.commit()
-        
-        if deleted_count > 0:
-            st.success(f"🔄 Reset complete! Removed {deleted_count} entries for user {user_id}")
-        
-        return deleted_count
-    except sqlite3.Error as e:
-        st.error(f"Error resetting data: {e}")
+    if deleted_count is None:
+        st.error("Error resetting data. Please try again.")
         return 0
-    finally:
-        conn.close()
+    
+    if deleted_count > 0:
+        st.success(f"🔄 Reset complete! Removed {deleted_count} entries for user {user_id}")
+    
+    return deleted_count
 
 if "tracker_started" not in st.session_state:
     st.session_state.tracker_started = False
@@ -178,6 +305,8 @@ if not st.session_state.tracker_started:
             st.rerun()
 
 else:
+    init_database()
+    
     # Main Dashboard
     st.markdown('<h1 class="main-header">💧 AI Water Tracker Dashboard</h1>', unsafe_allow_html=True)
     
@@ -208,6 +337,22 @@ else:
                     if st.checkbox("I'm sure I want to delete all my data"):
                         reset_user_data(user_id)
                         st.rerun()
+            
+            compactions = get_compaction_reports(limit=1)
+            if compactions:
+                last = compactions[0]
+                if last["status"] == "ok":
+                    st.caption(
+                        f"🗜️ Last compaction {last['run_at']}: archived {last['rows_archived']} entries "
+                        f"before {last['cutoff_date']}, reclaimed {last['reclaimed_bytes'] / 1024:.0f} KB, "
+                        f"queries {last['speedup']:.1f}x faster"
+                    )
+                else:
+                    st.caption(
+                        f"⚠️ Last compaction {last['run_at']} is {last['status']}: archived "
+                        f"{last['rows_archived']} entries before {last['cutoff_date']}"
+                        + (f" ({last['error']})" if last["error"] else "")
+                    )
         
         st.markdown("### Quick Log")
         col1, col2 = st.columns(2)
@@ -217,14 +362,12 @@ else:
                 if user_id:
                     log_intake(user_id, intake_ml)
                     st.success(f"Logged 250ml! 💧")
-                    st.rerun()
         with col2:
             if st.button("💧 500ml", use_container_width=True):
                 intake_ml = 500
                 if user_id:
                     log_intake(user_id, intake_ml)
                     st.success(f"Logged 500ml! 💦")
-                    st.rerun()
         
         st.markdown("---")
         st.markdown("### Custom Amount")
@@ -240,18 +383,25 @@ else:
                     if success:
                         st.balloons()
                         st.success(f"Successfully logged {intake_ml}ml! 🎉")
-                        st.rerun()
                     else:
                         st.error("Failed to log intake. Please try again.")
 
+    start_background_jobs()
+    
     # Main content area
     if user_id:
-        # Get VALIDATED history data
-        history = get_validated_intake_history(user_id)
-        today_total = get_validated_daily_total(user_id)
+        # Get VALIDATED history data (cached rows, only new entries are fetched)
+        archive_cutoff = get_archive_cutoff()
+        raw_history, df = get_cached_intake_history(user_id, archive_cutoff)
+        history = validate_intake_data(raw_history)
+        today_total = get_validated_daily_total(user_id, valid_history=history)
+        achievements = get_achievements(user_id)
+        
+        # Raw entries older than the last compaction cutoff live in the archive,
+        # so per-entry stats only cover the retention window
+        raw_window = f"since {archive_cutoff}" if archive_cutoff else "all time"
         
         # Check for data quality issues
-        raw_history = get_intake_history(user_id)
         if len(raw_history) > len(history):
             st.markdown(f"""
             <div class="warning-card">
@@ -284,38 +434,27 @@ else:
                 <div class="metric-card">
                     <h3>Average</h3>
                     <h2>{display_avg:.0f} ml</h2>
-                    <p>📊 Daily Average</p>
+                    <p>📊 Daily Average ({raw_window})</p>
                 </div>
                 """, unsafe_allow_html=True)
             else:
-                st.markdown("""
+                st.markdown(f"""
                 <div class="metric-card">
                     <h3>Average</h3>
                     <h2>0 ml</h2>
-                    <p>📊 Daily Average</p>
+                    <p>📊 Daily Average ({raw_window})</p>
                 </div>
                 """, unsafe_allow_html=True)
         
         with col3:
-            # Tracking Days
-            if history:
-                unique_dates = set([row[0] for row in history])
-                total_days = len(unique_dates)
-                st.markdown(f"""
-                <div class="metric-card">
-                    <h3>Tracking Days</h3>
-                    <h2>{total_days}</h2>
-                    <p>📅 Days Tracked</p>
-                </div>
-                """, unsafe_allow_html=True)
-            else:
-                st.markdown("""
-                <div class="metric-card">
-                    <h3>Tracking Days</h3>
-                    <h2>0</h2>
-                    <p>📅 Days Tracked</p>
-                </div>
-                """, unsafe_allow_html=True)
+            # Tracking Days (from the achievements rollup, which survives archival)
+            st.markdown(f"""
+            <div class="metric-card">
+                <h3>Tracking Days</h3>
+                <h2>{achievements["days_tracked"]}</h2>
+                <p>📅 Days Tracked</p>
+            </div>
+            """, unsafe_allow_html=True)
         
         with col4:
             # Daily Goal Progress
@@ -333,22 +472,8 @@ else:
 
         # Visualization Section (using only validated data)
         if history:
-            # Prepare data from validated history
-            dates = [datetime.strptime(row[0], "%Y-%m-%d") for row in history]
-            values = [min(row[1], 5000) for row in history]  # Cap values for visualization
-            
-            df = pd.DataFrame({
-                "Date": dates,
-                "Water_Intake_ml": values,
-                "Day": [date.strftime("%A") for date in dates]
-            })
-            
-            # Group by date for daily totals (capped at reasonable maximum)
-            daily_totals = df.groupby("Date")["Water_Intake_ml"].sum().reset_index()
-            daily_totals["Water_Intake_ml"] = daily_totals["Water_Intake_ml"].apply(lambda x: min(x, 10000))
-            
             # Create tabs for different visualizations
-            tab1, tab2, tab3 = st.tabs(["📈 Trend Analysis", "📊 Daily Details", "🎯 Progress"])
+            tab1, tab2, tab3, tab4 = st.tabs(["📈 Trend Analysis", "📊 Daily Details", "🎯 Progress", "🏅 Leaderboard"])
             
             with tab1:
                 col1, col2 = st.columns([2, 1])
@@ -356,17 +481,14 @@ else:
                 with col1:
                     # Line chart with Altair
                     st.subheader("Water Intake Trend")
-                    chart = alt.Chart(daily_totals).mark_line(point=True).encode(
-                        x='Date:T',
-                        y=alt.Y('Water_Intake_ml:Q', scale=alt.Scale(domain=[0, 5000]), title="Water Intake (ml)"),
-                        tooltip=['Date', 'Water_Intake_ml']
-                    ).properties(
-                        width=600,
-                        height=400
-                    )
-                    # Add goal line
-                    goal_line = alt.Chart(pd.DataFrame({'y': [2000]})).mark_rule(color='red', strokeDash=[5,5]).encode(y='y:Q')
-                    st.altair_chart(chart + goal_line, use_container_width=True)
+                    range_key = st.radio("Range", list(RANGES), index=1, horizontal=True)
+                    trend = get_intake_trend(user_id, range_key)
+                    if trend["points"]:
+                        st.altair_chart(build_trend_chart(trend), use_container_width=True)
+                        if trend["bucket"] != "day":
+                            st.caption(f"Daily totals grouped by {trend['bucket']}: line is the mean, band is min to max")
+                    else:
+                        st.info("No data in this range")
                 
                 with col2:
                     # Weekly summary
@@ -388,12 +510,14 @@ else:
                 with col1:
                     # Recent activity table
                     st.subheader("📋 Recent Entries")
+                    st.caption(f"Individual entries {raw_window}")
                     recent_df = df.sort_values("Date", ascending=False).head(10)
                     st.dataframe(recent_df, use_container_width=True)
                 
                 with col2:
                     # Statistics
                     st.subheader("📊 Statistics")
+                    st.caption(f"Covers entries {raw_window}")
                     st.metric("Total Valid Entries", len(history))
                     st.metric("Maximum Single Entry", f"{df['Water_Intake_ml'].max():.0f} ml")
                     st.metric("Minimum Single Entry", f"{df['Water_Intake_ml'].min():.0f} ml")
@@ -422,18 +546,54 @@ else:
                 
                 with col2:
                     st.subheader("🏆 Achievements")
+                    milestone_labels = {
+                        "streak_7": "🔥 7-Day Streak!",
+                        "streak_30": "🌟 30-Day Streak!",
+                        "goal_days_30": "🎯 30 Goal Days!",
+                        "goal_days_100": "💎 100 Goal Days!",
+                        "tracked_30": "⭐ Monthly Tracker!",
+                    }
                     
                     if today_total >= goal:
                         st.success("🎉 Daily Goal Achieved!")
                     
-                    if len(history) >= 7:
-                        st.success("🔥 7-Day Streak!")
-                    
-                    if len(history) >= 30:
-                        st.success("⭐ Monthly Tracker!")
+                    for milestone in achievements["milestones"]:
+                        st.success(milestone_labels.get(milestone, milestone))
                     
+                    st.metric("Current Streak", f"{achievements['current_streak']} days")
+                    st.metric("Longest Streak", f"{achievements['longest_streak']} days")
+                    st.metric("Days Goal Met", achievements["days_goal_met"])
                     st.metric("Goal Progress", f"{today_total}/{goal} ml")
 
+            with tab4:
+                period = st.radio("Period", ["daily", "weekly"], horizontal=True,
+                                  format_func=lambda p: "Today" if p == "daily" else "This Week")
+                col1, col2 = st.columns([2, 1])
+                
+                with col1:
+                    st.subheader("🏅 Top Hydrators")
+                    leaderboard = get_leaderboard(period, limit=10)
+                    if leaderboard["entries"]:
+                        st.dataframe(pd.DataFrame(leaderboard["entries"]), use_container_width=True, hide_index=True)
+                        st.caption(f"Updated {leaderboard['refreshed_at']}")
+                    elif leaderboard["refreshed_at"] is None:
+                        st.info(f"Rankings for this period are refreshed every {REFRESH_INTERVAL_MINUTES} minutes, check back soon")
+                    else:
+                        st.info("Nobody has logged water for this period yet")
+                
+                with col2:
+                    st.subheader("📍 Your Ranking")
+                    ranking = get_user_ranking(user_id, period)
+                    if ranking["rank"]:
+                        st.metric("Rank", f"#{ranking['rank']} of {ranking['user_count']}")
+                        st.metric("Total", f"{ranking['total_ml']:.0f} ml")
+                        if ranking["top_percent"] <= 50:
+                            st.success(f"You're in the top {ranking['top_percent']}%!")
+                        else:
+                            st.metric("Percentile", f"Top {ranking['top_percent']}%")
+                    else:
+                        st.info("Log some water to join the leaderboard")
+
             # AI Feedback Section
             st.markdown("---")
             st.markdown("### 🤖 AI Health Assistant")
@@ -1,12 +1,39 @@
+import asyncio
+import json
+from datetime import datetime
+from typing import Literal
 from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from apscheduler.schedulers.background import BackgroundScheduler
 from src.agent import WaterIntakeAgent
-from src.database import log_intake, get_intake_history
+from src.database import create_tables, log_intake, get_intake_history, get_achievements
+from src.archive import compact_intake, get_compaction_reports
+from src.events import subscribe
+from src.trends import RANGES, get_intake_trend
+from src.leaderboard import PERIODS, REFRESH_INTERVAL_MINUTES, refresh_leaderboards, get_leaderboard, get_user_ranking
 from src.logger import log_message
 
 
+# Unknown values are rejected by FastAPI with a 422 listing the allowed ones
+TrendRange = Literal[tuple(RANGES)]
+LeaderboardPeriod = Literal[PERIODS]
+
 app =  FastAPI()
 agent = WaterIntakeAgent()
+scheduler = BackgroundScheduler()
+
+@app.on_event("startup")
+def start_scheduled_jobs():
+    create_tables()
+    scheduler.add_job(refresh_leaderboards, "interval", minutes=REFRESH_INTERVAL_MINUTES,
+                      next_run_time=datetime.now())
+    scheduler.add_job(compact_intake, "cron", hour=3)
+    scheduler.start()
+
+@app.on_event("shutdown")
+def stop_scheduled_jobs():
+    scheduler.shutdown(wait=False)
 
 class WaterIntakeRequest(BaseModel):
     user_id: str
@@ -23,3 +50,45 @@ async def log_water_intake(request:WaterIntakeRequest):
 async def get_water_history(user_id:str):
     history =  get_intake_history(user_id)
     return{"user_id":user_id, "history":history}
+
+@app.get("/achievements/{user_id}")
+async def get_user_achievements(user_id:str):
+    achievements = get_achievements(user_id)
+    return{"user_id":user_id, "achievements":achievements}
+
+@app.get("/trend/{user_id}")
+async def get_water_trend(user_id:str, range:TrendRange = "30d"):
+    return get_intake_trend(user_id, range)
+
+@app.get("/leaderboard/{period}")
+async def get_period_leaderboard(period:LeaderboardPeriod, limit:int = 10):
+    return get_leaderboard(period, limit)
+
+@app.get("/leaderboard/{period}/{user_id}")
+async def get_period_user_ranking(period:LeaderboardPeriod, user_id:str):
+    return get_user_ranking(user_id, period)
+
+@app.get("/maintenance/compactions")
+async def get_compactions(limit:int = 10):
+    return{"reports":get_compaction_reports(limit)}
+
+@app.get("/events/{user_id}")
+async def stream_intake_events(user_id:str):
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def on_event(event):
+        if event.get("user_id") == user_id:
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    unsubscribe = subscribe(on_event)
+
+    async def event_stream():
+        try:
+            while True:
+                event = await queue.get()
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            unsubscribe()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
@@ -0,0 +1,393 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from src.database import DB_NAME, MAX_REASONABLE_INTAKE, archived_before, backfill_rollups
+from src.events import publish
+
+ARCHIVE_DB_NAME = 'water_tracker_archive.db'
+RETENTION_DAYS = 90
+# Raw rows moved per transaction, so memory use and write-lock time stay bounded
+ARCHIVE_BATCH_SIZE = 5000
+# Both the API and the dashboard schedule compaction; whoever takes the lease runs it
+COMPACTION_LEASE_MINUTES = 60
+
+def _file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+def _db_size():
+    """Bytes used on disk by the main database, including its WAL"""
+    return _file_size(DB_NAME) + _file_size(DB_NAME + '-wal')
+
+def ensure_archive_tables(cursor):
+    """
+    Creates the compaction log and lease in the main database and, if attached
+    as 'archive', the table of compressed raw rows in the archive database.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS intake_archive_log(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_at TEXT NOT NULL,
+            cutoff_date TEXT NOT NULL,
+            rows_archived INTEGER NOT NULL,
+            days_archived INTEGER NOT NULL,
+            bytes_before INTEGER NOT NULL,
+            bytes_after INTEGER NOT NULL,
+            query_ms_before REAL NOT NULL,
+            query_ms_after REAL NOT NULL,
+            status TEXT NOT NULL DEFAULT 'ok',
+            error TEXT
+        )
+    """)
+    # Logs created before runs recorded their outcome
+    cursor.execute("PRAGMA table_info(intake_archive_log)")
+    columns = [col[1] for col in cursor.fetchall()]
+    if "status" not in columns:
+        cursor.execute("ALTER TABLE intake_archive_log ADD COLUMN status TEXT NOT NULL DEFAULT 'ok'")
+    if "error" not in columns:
+        cursor.execute("ALTER TABLE intake_archive_log ADD COLUMN error TEXT")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS compaction_lease(
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            holder TEXT NOT NULL,
+            expires_at TEXT NOT NULL
+        )
+    """)
+    cursor.execute("PRAGMA database_list")
+    if any(row[1] == 'archive' for row in cursor.fetchall()):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS archive.archived_intake(
+                user_id TEXT NOT NULL,
+                date TEXT NOT NULL,
+                entries INTEGER NOT NULL,
+                total_ml REAL NOT NULL,
+                rows BLOB NOT NULL,
+                PRIMARY KEY (user_id, date)
+            )
+        """)
+
+def _time_hot_queries(cursor, sample_users=20, repeats=5):
+    """Milliseconds spent on the per-user history reads (get_intake_history, get_intake_since)"""
+    cursor.execute("SELECT DISTINCT user_id FROM water_intake LIMIT ?", (sample_users,))
+    users = [row[0] for row in cursor.fetchall()]
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for user_id in users:
+            cursor.execute(
+                "SELECT date, intake_ml FROM water_intake WHERE user_id = ? ORDER BY date DESC, id DESC",
+                (user_id,)
+            ).fetchall()
+            cursor.execute(
+                "SELECT id, date, intake_ml FROM water_intake WHERE user_id = ? AND id > ? ORDER BY id",
+                (user_id, 0)
+            ).fetchall()
+    return (time.perf_counter() - start) * 1000 / repeats
+
+def _archive_rows(conn, cutoff, log_id, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Move raw rows older than cutoff into archive.archived_intake, one compressed blob
+    per user-day, batch_size rows per transaction. The log row's counts are updated
+    with each batch, so an interrupted run still records what it moved.
+    """
+    cursor = conn.cursor()
+    rows_archived = days_archived = 0
+    last_id = 0
+    while True:
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(
+            "SELECT id, user_id, date, intake_ml FROM water_intake WHERE date < ? AND id > ? ORDER BY id LIMIT ?",
+            (cutoff, last_id, batch_size)
+        )
+        batch = cursor.fetchall()
+        if not batch:
+            conn.rollback()
+            break
+
+        days = {}
+        for intake_id, user_id, date, intake_ml in batch:
+            days.setdefault((user_id, date), []).append([intake_id, intake_ml])
+
+        for (user_id, date), rows in days.items():
+            # Merge with anything already archived for that day (e.g. by the previous batch)
+            cursor.execute(
+                "SELECT rows FROM archive.archived_intake WHERE user_id = ? AND date = ?",
+                (user_id, date)
+            )
+            existing = cursor.fetchone()
+            if existing:
+                rows = json.loads(zlib.decompress(existing[0])) + rows
+            else:
+                days_archived += 1
+
+            valid = [intake_ml for _, intake_ml in rows if intake_ml <= MAX_REASONABLE_INTAKE]
+            cursor.execute(
+                """
+                INSERT OR REPLACE INTO archive.archived_intake (user_id, date, entries, total_ml, rows)
+                VALUES(?,?,?,?,?)
+                """,
+                (user_id, date, len(valid), sum(valid), zlib.compress(json.dumps(rows).encode()))
+            )
+
+        # The batch is every old row in (last_id, batch max id], read under the write lock
+        cursor.execute(
+            "DELETE FROM water_intake WHERE date < ? AND id > ? AND id <= ?",
+            (cutoff, last_id, batch[-1][0])
+        )
+        rows_archived += cursor.rowcount
+        last_id = batch[-1][0]
+        cursor.execute(
+            "UPDATE intake_archive_log SET rows_archived = ?, days_archived = ? WHERE id = ?",
+            (rows_archived, days_archived, log_id)
+        )
+        conn.commit()
+    return rows_archived, days_archived
+
+def _compact(conn):
+    """Return freed pages to the filesystem and fold the WAL back into the database"""
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA auto_vacuum")
+    if cursor.fetchone()[0] != 2:
+        # Switching to incremental auto-vacuum needs one full VACUUM outside WAL mode
+        cursor.execute("PRAGMA journal_mode")
+        journal_mode = cursor.fetchone()[0]
+        if journal_mode == 'wal':
+            cursor.execute("PRAGMA journal_mode = DELETE")
+        try:
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            cursor.execute("VACUUM")
+        finally:
+            if journal_mode == 'wal':
+                cursor.execute("PRAGMA journal_mode = WAL")
+    else:
+        # executescript steps the pragma to completion; cursor.execute frees a single page
+        conn.executescript("PRAGMA incremental_vacuum;")
+    cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+def _acquire_lease(conn, holder, cutoff):
+    """
+    Take the compaction lease unless another process holds an unexpired one
+    or a run already completed for this cutoff. Returns True if we may compact.
+    """
+    cursor = conn.cursor()
+    now = datetime.now()
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute("SELECT expires_at FROM compaction_lease WHERE id = 1")
+    lease = cursor.fetchone()
+    if lease and lease[0] > now.isoformat():
+        conn.rollback()
+        return False
+    cursor.execute(
+        "SELECT 1 FROM intake_archive_log WHERE cutoff_date = ? AND status = 'ok'",
+        (cutoff,)
+    )
+    if cursor.fetchone():
+        conn.rollback()
+        return False
+
+    expires_at = (now + timedelta(minutes=COMPACTION_LEASE_MINUTES)).isoformat()
+    cursor.execute("INSERT OR REPLACE INTO compaction_lease (id, holder, expires_at) VALUES(1,?,?)", (holder, expires_at))
+    conn.commit()
+    return True
+
+def _release_lease(conn, holder):
+    try:
+        conn.rollback()
+        conn.execute("DELETE FROM compaction_lease WHERE id = 1 AND holder = ?", (holder,))
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"✗ Error releasing compaction lease: {e}")
+
+def _record_failure(conn, log_id, step, error):
+    """Mark a compaction run's log row with the step that failed"""
+    try:
+        conn.rollback()
+        conn.execute(
+            "UPDATE intake_archive_log SET status = ?, error = ? WHERE id = ?",
+            (f"{step}_failed", str(error), log_id)
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"✗ Error recording failed compaction: {e}")
+
+def compact_intake(retention_days=RETENTION_DAYS):
+    """
+    Archive raw intake rows older than retention_days, then vacuum and checkpoint.
+    Their daily totals stay in daily_totals, so trends, streaks and leaderboards
+    are unaffected. Returns a report of the space reclaimed and the hot-query speedup.
+    Each run is logged in intake_archive_log with its status ('running', 'ok', or
+    the step that failed, e.g. 'compact_failed') and the error message. Returns None
+    without doing anything if another process is compacting or this cutoff is done.
+    """
+    cutoff = (datetime.today() - timedelta(days=retention_days)).strftime('%Y-%m-%d')
+    holder = uuid.uuid4().hex
+    conn = None
+    leased = False
+    log_id = None
+    step = "setup"
+    try:
+        conn = sqlite3.connect(DB_NAME)
+        cursor = conn.cursor()
+        ensure_archive_tables(cursor)
+        conn.commit()
+        leased = _acquire_lease(conn, holder, cutoff)
+        if not leased:
+            print(f"⏭️ Skipping compaction: already running elsewhere or done for cutoff {cutoff}")
+            return None
+
+        bytes_before = _db_size()
+        query_ms_before = _time_hot_queries(cursor)
+
+        cursor.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_NAME,))
+        ensure_archive_tables(cursor)
+        report = {
+            "run_at": datetime.now().isoformat(timespec='seconds'),
+            "cutoff_date": cutoff,
+            "rows_archived": 0,
+            "days_archived": 0,
+            "bytes_before": bytes_before,
+            "bytes_after": bytes_before,
+            "query_ms_before": query_ms_before,
+            "query_ms_after": query_ms_before,
+            "status": "running",
+        }
+        # Logged before the first row moves: rebuild_rollups reads the cutoff from
+        # here to know which daily totals may no longer have raw rows
+        cursor.execute(
+            f"INSERT INTO intake_archive_log ({', '.join(report)}) VALUES({','.join('?' * len(report))})",
+            tuple(report.values())
+        )
+        log_id = cursor.lastrowid
+        conn.commit()
+
+        step = "archive"
+        rows_archived, days_archived = _archive_rows(conn, cutoff, log_id)
+        report["rows_archived"], report["days_archived"] = rows_archived, days_archived
+        cursor.execute("DETACH DATABASE archive")
+
+        # e.g. "database is locked" when another connection blocks the journal mode switch
+        step = "compact"
+        _compact(conn)
+
+        step = "measure"
+        report["bytes_after"] = _db_size()
+        report["query_ms_after"] = _time_hot_queries(cursor)
+        report["status"] = "ok"
+        cursor.execute(
+            "UPDATE intake_archive_log SET bytes_after = ?, query_ms_after = ?, status = ? WHERE id = ?",
+            (report["bytes_after"], report["query_ms_after"], report["status"], log_id)
+        )
+        conn.commit()
+        report = _with_summary(report)
+
+        print(f"🗜️ Archived {rows_archived} rows ({days_archived} user-days) older than {cutoff}")
+        print(f"💾 Reclaimed {report['reclaimed_bytes']} bytes, hot queries {report['speedup']:.1f}x faster")
+        return report
+
+    except sqlite3.Error as e:
+        print(f"✗ Error compacting intake data during {step}: {e}")
+        if log_id is not None:
+            _record_failure(conn, log_id, step, e)
+        return None
+    finally:
+        if conn:
+            if leased:
+                _release_lease(conn, holder)
+            conn.close()
+
+def _with_summary(report):
+    # The "after" columns are only measured once a run completes
+    if report["status"] != "ok":
+        report["reclaimed_bytes"] = report["speedup"] = None
+        return report
+    report["reclaimed_bytes"] = report["bytes_before"] - report["bytes_after"]
+    report["speedup"] = (
+        report["query_ms_before"] / report["query_ms_after"] if report["query_ms_after"] else 1.0
+    )
+    return report
+
+def get_compaction_reports(limit=10):
+    """Get the most recent compaction runs, newest first"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_NAME)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        ensure_archive_tables(cursor)
+        cursor.execute(
+            """
+            SELECT run_at, cutoff_date, rows_archived, days_archived,
+                   bytes_before, bytes_after, query_ms_before, query_ms_after, status, error
+            FROM intake_archive_log ORDER BY id DESC LIMIT ?
+            """,
+            (limit,)
+        )
+        return [_with_summary(dict(row)) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"✗ Error fetching compaction reports: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+def get_archive_cutoff():
+    """Date before which raw intake rows have moved to the archive ('' if none have)"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_NAME)
+        return archived_before(conn.cursor())
+    except sqlite3.Error as e:
+        print(f"✗ Error fetching archive cutoff: {e}")
+        return ""
+    finally:
+        if conn:
+            conn.close()
+
+def reset_user_intake(user_id):
+    """
+    Delete all of a user's intake, hot and archived, and their rollups in one
+    transaction. Returns the number of raw entries removed, or None on error.
+    """
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_NAME)
+        cursor = conn.cursor()
+        # ATTACH isn't allowed inside a transaction, so it goes first
+        has_archive = os.path.exists(ARCHIVE_DB_NAME)
+        if has_archive:
+            cursor.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_NAME,))
+            ensure_archive_tables(cursor)
+
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("DELETE FROM water_intake WHERE user_id = ?", (user_id,))
+        deleted = cursor.rowcount
+        if has_archive:
+            cursor.execute("SELECT rows FROM archive.archived_intake WHERE user_id = ?", (user_id,))
+            deleted += sum(len(json.loads(zlib.decompress(rows))) for rows, in cursor.fetchall())
+            cursor.execute("DELETE FROM archive.archived_intake WHERE user_id = ?", (user_id,))
+
+        # Days before the cutoff have no raw rows to rebuild from, so the backfill
+        # leaves them alone; drop them here, then rebuild the rest (now empty)
+        cursor.execute(
+            "DELETE FROM daily_totals WHERE user_id = ? AND date < ?",
+            (user_id, archived_before(cursor))
+        )
+        backfill_rollups(cursor, user_id)
+        conn.commit()
+
+        publish({"type": "rollups_rebuilt", "user_id": user_id})
+        return deleted
+    except sqlite3.Error as e:
+        print(f"✗ Error resetting user intake: {e}")
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+# Run from the repo root: python -m src.archive
+if __name__ == "__main__":
+    print("🧪 Running intake compaction...")
+    print(compact_intake())
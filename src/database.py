@@ -1,8 +1,21 @@
 import sqlite3
-from datetime import datetime
+import sys
+from datetime import datetime, timedelta
 import os
+from src.events import publish
 
 DB_NAME = 'water_tracker.db'
+DAILY_GOAL_ML = 2000
+MAX_REASONABLE_INTAKE = 5000
+
+# (milestone key, counter in user_achievements, threshold)
+ACHIEVEMENT_MILESTONES = [
+    ("streak_7", "longest_streak", 7),
+    ("streak_30", "longest_streak", 30),
+    ("goal_days_30", "days_goal_met", 30),
+    ("goal_days_100", "days_goal_met", 100),
+    ("tracked_30", "days_tracked", 30),
+]
 
 def create_tables():
     """
@@ -28,7 +41,8 @@ def create_tables():
             cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='water_intake_backup'")
             backup_exists = cursor.fetchone()
             
-            if not backup_exists:
+            # Nothing to back up on a fresh database
+            if current_columns and not backup_exists:
                 cursor.execute("ALTER TABLE water_intake RENAME TO water_intake_backup")
                 print("📦 Backed up existing table")
             
@@ -58,6 +72,8 @@ def create_tables():
         else:
             print("✅ Table structure is correct")
         
+        ensure_daily_totals_table(cursor)
+        ensure_achievements_table(cursor)
         conn.commit()
         print("✓ Database tables are ready")
         return True
@@ -69,6 +85,146 @@ def create_tables():
         if conn:
             conn.close()
 
+def _previous_day(date):
+    """Return the day before a YYYY-MM-DD date string"""
+    return (datetime.strptime(date, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+
+def _advance_achievements(stats, date, entries_before, total_before, intake_ml):
+    """Fold one valid intake entry into a user's achievement counters"""
+    if entries_before == 0:
+        stats["days_tracked"] += 1
+        stats["last_log_date"] = date
+    
+    # Only the entry that pushes the day over the goal counts towards streaks
+    if total_before < DAILY_GOAL_ML <= total_before + intake_ml:
+        stats["days_goal_met"] += 1
+        if stats["last_goal_date"] == _previous_day(date):
+            stats["current_streak"] += 1
+        else:
+            stats["current_streak"] = 1
+        stats["longest_streak"] = max(stats["longest_streak"], stats["current_streak"])
+        stats["last_goal_date"] = date
+    return stats
+
+def _empty_achievements():
+    return {
+        "current_streak": 0,
+        "longest_streak": 0,
+        "days_goal_met": 0,
+        "days_tracked": 0,
+        "last_log_date": None,
+        "last_goal_date": None,
+    }
+
+def _save_achievements(cursor, user_id, stats):
+    cursor.execute(
+        """
+        INSERT OR REPLACE INTO user_achievements
+            (user_id, current_streak, longest_streak, days_goal_met, days_tracked, last_log_date, last_goal_date)
+        VALUES(?,?,?,?,?,?,?)
+        """,
+        (user_id, stats["current_streak"], stats["longest_streak"], stats["days_goal_met"],
+         stats["days_tracked"], stats["last_log_date"], stats["last_goal_date"])
+    )
+
+def _backfill_achievements(cursor, user_id=None):
+    """Rebuild achievement counters from the daily_totals rollup"""
+    query = "SELECT user_id, date, total_ml FROM daily_totals{} ORDER BY user_id, date"
+    if user_id is None:
+        cursor.execute(query.format(""))
+        rows = cursor.fetchall()
+        cursor.execute("DELETE FROM user_achievements")
+    else:
+        cursor.execute(query.format(" WHERE user_id = ?"), (user_id,))
+        rows = cursor.fetchall()
+        cursor.execute("DELETE FROM user_achievements WHERE user_id = ?", (user_id,))
+    
+    all_stats = {}
+    for row_user, date, day_total in rows:
+        stats = all_stats.setdefault(row_user, _empty_achievements())
+        _advance_achievements(stats, date, 0, 0, day_total)
+    
+    for row_user, stats in all_stats.items():
+        _save_achievements(cursor, row_user, stats)
+    return len(all_stats)
+
+def archived_before(cursor):
+    """
+    Date before which raw rows have been moved to the archive database.
+    Those days only survive in daily_totals, so rebuilds must leave them alone.
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='intake_archive_log'")
+    if not cursor.fetchone():
+        return ""
+    cursor.execute("SELECT COALESCE(MAX(cutoff_date), '') FROM intake_archive_log")
+    return cursor.fetchone()[0]
+
+def _backfill_daily_totals(cursor, user_id=None):
+    """Rebuild the per-user, per-day rollup from the raw intake rows that are still hot"""
+    cutoff = archived_before(cursor)
+    query = """
+        INSERT INTO daily_totals (user_id, date, entries, total_ml)
+        SELECT user_id, date, COUNT(*), SUM(intake_ml) FROM water_intake
+        WHERE intake_ml <= ? AND date >= ?{}
+        GROUP BY user_id, date
+    """
+    if user_id is None:
+        cursor.execute("DELETE FROM daily_totals WHERE date >= ?", (cutoff,))
+        cursor.execute(query.format(""), (MAX_REASONABLE_INTAKE, cutoff))
+    else:
+        cursor.execute("DELETE FROM daily_totals WHERE user_id = ? AND date >= ?", (user_id, cutoff))
+        cursor.execute(query.format(" AND user_id = ?"), (MAX_REASONABLE_INTAKE, cutoff, user_id))
+    return cursor.rowcount
+
+def ensure_daily_totals_table(cursor):
+    """
+    Creates the daily_totals rollup (one row per user and day, valid entries only).
+    Existing intake data is backfilled the first time the table is created.
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='daily_totals'")
+    if cursor.fetchone():
+        return
+    
+    cursor.execute("""
+        CREATE TABLE daily_totals(
+            user_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            entries INTEGER NOT NULL,
+            total_ml REAL NOT NULL,
+            PRIMARY KEY (user_id, date)
+        )
+    """)
+    cursor.execute("CREATE INDEX idx_daily_totals_date ON daily_totals(date, total_ml)")
+    days = _backfill_daily_totals(cursor)
+    print(f"📅 Created daily_totals table, backfilled {days} user-days")
+
+def ensure_achievements_table(cursor):
+    """
+    Creates the materialized achievements table (and the intake index it relies on).
+    Existing intake data is backfilled the first time the table is created.
+    """
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_water_intake_user_date ON water_intake(user_id, date)"
+    )
+    ensure_daily_totals_table(cursor)
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_achievements'")
+    if cursor.fetchone():
+        return
+    
+    cursor.execute("""
+        CREATE TABLE user_achievements(
+            user_id TEXT PRIMARY KEY,
+            current_streak INTEGER NOT NULL DEFAULT 0,
+            longest_streak INTEGER NOT NULL DEFAULT 0,
+            days_goal_met INTEGER NOT NULL DEFAULT 0,
+            days_tracked INTEGER NOT NULL DEFAULT 0,
+            last_log_date TEXT,
+            last_goal_date TEXT
+        )
+    """)
+    users = _backfill_achievements(cursor)
+    print(f"🏆 Created achievements table, backfilled {users} users")
+
 def log_intake(user_id, intake_ml):
     """Log water intake for a user"""
     conn = None
@@ -79,12 +235,53 @@ def log_intake(user_id, intake_ml):
         
         print(f"📝 Logging: user={user_id}, intake={intake_ml}ml, date={date_today}")
         
+        # Take the write lock before reading today's totals so concurrent writers
+        # (other sessions, the API) can't both build on the same previous values
+        cursor.execute("BEGIN IMMEDIATE")
+        if intake_ml <= MAX_REASONABLE_INTAKE:
+            cursor.execute(
+                "SELECT entries, total_ml FROM daily_totals WHERE user_id = ? AND date = ?",
+                (user_id, date_today)
+            )
+            entries_before, total_before = cursor.fetchone() or (0, 0)
+            cursor.execute(
+                """
+                INSERT INTO daily_totals (user_id, date, entries, total_ml)
+                VALUES(?,?,1,?)
+                ON CONFLICT(user_id, date) DO UPDATE SET
+                    entries = entries + 1,
+                    total_ml = total_ml + excluded.total_ml
+                """,
+                (user_id, date_today, intake_ml)
+            )
+            
+            cursor.execute(
+                """
+                SELECT current_streak, longest_streak, days_goal_met, days_tracked, last_log_date, last_goal_date
+                FROM user_achievements WHERE user_id = ?
+                """,
+                (user_id,)
+            )
+            row = cursor.fetchone()
+            stats = dict(zip(_empty_achievements().keys(), row)) if row else _empty_achievements()
+            _advance_achievements(stats, date_today, entries_before, total_before, intake_ml)
+            _save_achievements(cursor, user_id, stats)
+        
         cursor.execute(
             "INSERT INTO water_intake (user_id, intake_ml, date) VALUES(?,?,?)", 
             (user_id, intake_ml, date_today)
         )
+        intake_id = cursor.lastrowid
         conn.commit()
         print(f"✅ Successfully logged {intake_ml}ml for user {user_id}")
+        
+        publish({
+            "type": "intake_logged",
+            "id": intake_id,
+            "user_id": user_id,
+            "intake_ml": intake_ml,
+            "date": date_today,
+        })
         return True
         
     except sqlite3.Error as e:
@@ -119,6 +316,24 @@ def get_intake_history(user_id):
         if conn:
             conn.close()
 
+def get_intake_since(user_id, last_id=0):
+    """Get (id, date, intake_ml) rows logged after last_id, oldest first"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_NAME)
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, date, intake_ml FROM water_intake WHERE user_id = ? AND id > ? ORDER BY id", 
+            (user_id, last_id)
+        )
+        return cursor.fetchall()
+    except sqlite3.Error as e:
+        print(f"✗ Error fetching new intake rows: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
 def get_daily_total(user_id, date=None):
     """Get total water intake for a user on a specific date"""
     conn = None
@@ -145,8 +360,77 @@ def get_daily_total(user_id, date=None):
         if conn:
             conn.close()
 
-# Test the database when run directly
-if __name__ == "__main__":
+def backfill_rollups(cursor, user_id=None):
+    """Recompute daily totals and achievements inside the caller's transaction"""
+    _backfill_daily_totals(cursor, user_id)
+    return _backfill_achievements(cursor, user_id)
+
+def rebuild_rollups(user_id=None):
+    """
+    Recompute daily totals and achievements from the hot intake rows, for one user
+    or for everybody. This is the backfill job: python -m src.database --rebuild-rollups
+    """
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_NAME)
+        cursor = conn.cursor()
+        ensure_daily_totals_table(cursor)
+        ensure_achievements_table(cursor)
+        users = backfill_rollups(cursor, user_id)
+        conn.commit()
+        print(f"🔁 Rebuilt rollups for {users} users")
+        
+        publish({"type": "rollups_rebuilt", "user_id": user_id})
+        return users
+    except sqlite3.Error as e:
+        print(f"✗ Error rebuilding rollups: {e}")
+        return 0
+    finally:
+        if conn:
+            conn.close()
+
+def get_achievements(user_id):
+    """Get streaks, goal days and milestones for a user from the materialized table"""
+    conn = None
+    stats = _empty_achievements()
+    try:
+        conn = sqlite3.connect(DB_NAME)
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT current_streak, longest_streak, days_goal_met, days_tracked, last_log_date, last_goal_date
+            FROM user_achievements WHERE user_id = ?
+            """,
+            (user_id,)
+        )
+        row = cursor.fetchone()
+        if row:
+            stats = dict(zip(stats.keys(), row))
+    except sqlite3.Error as e:
+        print(f"✗ Error fetching achievements: {e}")
+    finally:
+        if conn:
+            conn.close()
+    
+    # A streak is still alive until a full day passes without meeting the goal
+    today = datetime.today().strftime('%Y-%m-%d')
+    if stats["last_goal_date"] not in (today, _previous_day(today)):
+        stats["current_streak"] = 0
+    
+    stats["milestones"] = [
+        key for key, counter, threshold in ACHIEVEMENT_MILESTONES
+        if stats[counter] >= threshold
+    ]
+    return stats
+
+# Test the database when run directly: python -m src.database (from the repo root)
+# Rebuild all rollups instead with: python -m src.database --rebuild-rollups
+if __name__ == "__main__" and "--rebuild-rollups" in sys.argv[1:]:
+    if create_tables():
+        rebuild_rollups()
+    else:
+        print("❌ Database setup failed")
+elif __name__ == "__main__":
     print("🧪 Testing database setup...")
     if create_tables():
         # Test with sample data
@@ -161,5 +445,8 @@ if __name__ == "__main__":
         print("\n🧪 Testing daily total functionality...")
         total = get_daily_total("test_user")
         print(f"Test daily total: {total}ml")
+        
+        print("\n🧪 Testing achievements functionality...")
+        print(f"Test achievements: {get_achievements('test_user')}")
     else:
         print("❌ Database setup failed")
\ No newline at end of file
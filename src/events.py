@@ -0,0 +1,25 @@
+import threading
+
+_subscribers = []
+_lock = threading.Lock()
+
+def subscribe(callback):
+    """Register a callback for intake events. Returns a function that unsubscribes it."""
+    with _lock:
+        _subscribers.append(callback)
+
+    def unsubscribe():
+        with _lock:
+            if callback in _subscribers:
+                _subscribers.remove(callback)
+    return unsubscribe
+
+def publish(event):
+    """Send an event dict to every subscriber in this process"""
+    with _lock:
+        callbacks = list(_subscribers)
+    for callback in callbacks:
+        try:
+            callback(event)
+        except Exception as e:
+            print(f"✗ Event subscriber failed on {event.get('type')}: {e}")
@@ -0,0 +1,218 @@
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from src.database import DB_NAME
+
+# Rankings live in their own database file so a refresh only ever holds a
+# read snapshot on the intake database and never blocks log_intake
+LEADERBOARD_DB_NAME = 'water_tracker_rankings.db'
+PERIODS = ("daily", "weekly")
+REFRESH_INTERVAL_MINUTES = 5
+
+def _period_bounds(period, date=None):
+    """Return the first and last YYYY-MM-DD day of the period containing date"""
+    if period not in PERIODS:
+        raise ValueError(f"Unknown leaderboard period: {period}")
+
+    day = datetime.strptime(date, '%Y-%m-%d') if date else datetime.today()
+    if period == "weekly":
+        start = day - timedelta(days=day.weekday())
+        end = start + timedelta(days=6)
+    else:
+        start = end = day
+    return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+
+def ensure_leaderboard_tables(cursor):
+    """
+    Creates the precomputed ranking tables. Each refresh writes a new generation
+    of ranks and then points leaderboard_refreshes at it, so readers always see
+    one complete ranking and stay index lookups no matter how many users are ranked.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS leaderboard_ranks(
+            period TEXT NOT NULL,
+            generation INTEGER NOT NULL,
+            user_id TEXT NOT NULL,
+            total_ml REAL NOT NULL,
+            rank INTEGER NOT NULL,
+            PRIMARY KEY (period, generation, user_id)
+        )
+    """)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_leaderboard_ranks_rank ON leaderboard_ranks(period, generation, rank)"
+    )
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS leaderboard_refreshes(
+            period TEXT PRIMARY KEY,
+            period_start TEXT NOT NULL,
+            generation INTEGER NOT NULL,
+            user_count INTEGER NOT NULL,
+            refreshed_at TEXT NOT NULL
+        )
+    """)
+
+def _refresh_leaderboard(conn, period, date=None):
+    """Build a new generation of ranks for the period, swap it in, then drop the old ones"""
+    cursor = conn.cursor()
+    start, end = _period_bounds(period, date)
+
+    # Deferred on purpose: BEGIN IMMEDIATE would also take the write lock on
+    # the attached intake database, which is only read here
+    cursor.execute("BEGIN")
+    cursor.execute(
+        "SELECT COALESCE(MAX(generation), 0) + 1 FROM leaderboard_ranks WHERE period = ?",
+        (period,)
+    )
+    generation = cursor.fetchone()[0]
+    cursor.execute(
+        """
+        INSERT INTO leaderboard_ranks (period, generation, user_id, total_ml, rank)
+        SELECT ?, ?, user_id, SUM(total_ml), RANK() OVER (ORDER BY SUM(total_ml) DESC)
+        FROM intake.daily_totals
+        WHERE date BETWEEN ? AND ?
+        GROUP BY user_id
+        """,
+        (period, generation, start, end)
+    )
+    user_count = cursor.rowcount
+    cursor.execute(
+        """
+        INSERT OR REPLACE INTO leaderboard_refreshes (period, period_start, generation, user_count, refreshed_at)
+        VALUES(?,?,?,?,?)
+        """,
+        (period, start, generation, user_count, datetime.now().isoformat(timespec='seconds'))
+    )
+    conn.commit()
+
+    # Readers have moved to the new generation; older ones (including past periods) can go
+    cursor.execute(
+        "DELETE FROM leaderboard_ranks WHERE period = ? AND generation < ?",
+        (period, generation)
+    )
+    conn.commit()
+    return user_count
+
+def refresh_leaderboards(date=None):
+    """Recompute daily and weekly rankings from the daily_totals rollup"""
+    conn = None
+    try:
+        conn = sqlite3.connect(LEADERBOARD_DB_NAME)
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA journal_mode = WAL")
+        ensure_leaderboard_tables(cursor)
+        conn.commit()
+        cursor.execute("ATTACH DATABASE ? AS intake", (DB_NAME,))
+
+        counts = {period: _refresh_leaderboard(conn, period, date) for period in PERIODS}
+        print(f"🏁 Refreshed leaderboards: {counts}")
+        return counts
+    except sqlite3.Error as e:
+        print(f"✗ Error refreshing leaderboards: {e}")
+        return {}
+    finally:
+        if conn:
+            conn.close()
+
+def _load_refresh(cursor, period, start):
+    """Return (generation, user_count, refreshed_at) of the last completed refresh for this period"""
+    cursor.execute(
+        "SELECT generation, user_count, refreshed_at FROM leaderboard_refreshes WHERE period = ? AND period_start = ?",
+        (period, start)
+    )
+    return cursor.fetchone()
+
+def _connect_rankings():
+    """Open the rankings database, or None before the first refresh created it"""
+    if not os.path.exists(LEADERBOARD_DB_NAME):
+        return None
+    return sqlite3.connect(LEADERBOARD_DB_NAME)
+
+def get_leaderboard(period="daily", limit=10):
+    """Get the top users for the current period from the last completed refresh"""
+    start, _ = _period_bounds(period)
+    leaderboard = {"period": period, "period_start": start, "user_count": 0, "refreshed_at": None, "entries": []}
+    conn = None
+    try:
+        conn = _connect_rankings()
+        if conn is None:
+            return leaderboard
+        cursor = conn.cursor()
+        # One read transaction for the pointer and the ranks, so a refresh that
+        # commits in between can't prune the generation we are about to read
+        cursor.execute("BEGIN")
+        refresh = _load_refresh(cursor, period, start)
+        if refresh is None:
+            return leaderboard
+        generation, leaderboard["user_count"], leaderboard["refreshed_at"] = refresh
+
+        cursor.execute(
+            """
+            SELECT rank, user_id, total_ml FROM leaderboard_ranks
+            WHERE period = ? AND generation = ?
+            ORDER BY rank, user_id
+            LIMIT ?
+            """,
+            (period, generation, limit)
+        )
+        leaderboard["entries"] = [
+            {"rank": rank, "user_id": user_id, "total_ml": total_ml}
+            for rank, user_id, total_ml in cursor.fetchall()
+        ]
+    except sqlite3.Error as e:
+        print(f"✗ Error fetching leaderboard: {e}")
+    finally:
+        if conn:
+            conn.close()
+    return leaderboard
+
+def get_user_ranking(user_id, period="daily"):
+    """Get a user's rank and cohort percentile ("top N%") from the last completed refresh"""
+    start, _ = _period_bounds(period)
+    ranking = {
+        "user_id": user_id,
+        "period": period,
+        "period_start": start,
+        "rank": None,
+        "user_count": 0,
+        "total_ml": 0,
+        "top_percent": None,
+        "refreshed_at": None,
+    }
+    conn = None
+    try:
+        conn = _connect_rankings()
+        if conn is None:
+            return ranking
+        cursor = conn.cursor()
+        # Same snapshot for the pointer and the rank lookup (see get_leaderboard)
+        cursor.execute("BEGIN")
+        refresh = _load_refresh(cursor, period, start)
+        if refresh is None:
+            return ranking
+        generation, ranking["user_count"], ranking["refreshed_at"] = refresh
+
+        cursor.execute(
+            """
+            SELECT rank, total_ml FROM leaderboard_ranks
+            WHERE period = ? AND generation = ? AND user_id = ?
+            """,
+            (period, generation, user_id)
+        )
+        row = cursor.fetchone()
+        if row and ranking["user_count"]:
+            ranking["rank"], ranking["total_ml"] = row
+            # Rank 1 of 5 users is the top 20%
+            ranking["top_percent"] = max(1, round(100 * row[0] / ranking["user_count"]))
+    except sqlite3.Error as e:
+        print(f"✗ Error fetching user ranking: {e}")
+    finally:
+        if conn:
+            conn.close()
+    return ranking
+
+# Run from the repo root: python -m src.leaderboard
+if __name__ == "__main__":
+    print("🧪 Testing leaderboard refresh...")
+    refresh_leaderboards()
+    print(get_leaderboard("daily"))
+    print(get_user_ranking("test_user", "weekly"))
@@ -0,0 +1,136 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from src.database import DB_NAME
+from src.events import subscribe
+
+# Range key -> number of days back from today (None means all history)
+RANGES = {"7d": 7, "30d": 30, "1y": 365, "all": None}
+MAX_DAILY_TOTAL = 10000
+MAX_TREND_POINTS = 120
+MAX_CACHED_TRENDS = 256
+
+# Bucket key -> SQLite expression giving the first day of the bucket
+_BUCKETS = {
+    "day": "date",
+    "week": "date(date, 'weekday 0', '-6 days')",
+    "month": "strftime('%Y-%m-01', date)",
+    "quarter": "date(date, 'start of month', printf('-%d months', (CAST(strftime('%m', date) AS INTEGER) - 1) % 3))",
+    "year": "strftime('%Y-01-01', date)",
+}
+# Shortest length in days of each bucket, finest first
+_BUCKET_DAYS = {"day": 1, "week": 7, "month": 28, "quarter": 90, "year": 365}
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_generation = [0]
+
+def _on_event(event):
+    """Drop cached trends for a user whenever their daily totals change"""
+    user_id = event.get("user_id")
+    with _cache_lock:
+        _generation[0] += 1
+        for key in list(_cache):
+            if user_id is None or key[0] == user_id:
+                del _cache[key]
+
+subscribe(_on_event)
+
+def _bucket_for(range_key, first_date, today):
+    """Pick the finest bucket that keeps the chart at MAX_TREND_POINTS points or fewer"""
+    span_days = RANGES[range_key]
+    if span_days is None:
+        span_days = (today - datetime.strptime(first_date, '%Y-%m-%d')).days + 1 if first_date else 1
+
+    for bucket, bucket_days in _BUCKET_DAYS.items():
+        # A span can touch one partial bucket at each end
+        if (span_days - 1) // bucket_days + 2 <= MAX_TREND_POINTS:
+            return bucket
+    return "year"
+
+def _load_trend(user_id, range_key, today):
+    days = RANGES[range_key]
+    start = (today - timedelta(days=days - 1)).strftime('%Y-%m-%d') if days else "0000-00-00"
+
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_NAME)
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT MIN(date) FROM daily_totals WHERE user_id = ? AND date >= ?",
+            (user_id, start)
+        )
+        bucket = _bucket_for(range_key, cursor.fetchone()[0], today)
+
+        cursor.execute(
+            f"""
+            SELECT {_BUCKETS[bucket]} AS bucket_start,
+                   MIN(day_total), AVG(day_total), MAX(day_total), COUNT(*)
+            FROM (
+                SELECT date, MIN(total_ml, ?) AS day_total FROM daily_totals
+                WHERE user_id = ? AND date >= ?
+            )
+            GROUP BY bucket_start
+            ORDER BY bucket_start
+            """,
+            (MAX_DAILY_TOTAL, user_id, start)
+        )
+        points = [
+            {"date": bucket_start, "min_ml": low, "mean_ml": mean, "max_ml": high, "days": days_logged}
+            for bucket_start, low, mean, high, days_logged in cursor.fetchall()
+        ]
+        return {"user_id": user_id, "range": range_key, "bucket": bucket, "points": points}
+    except sqlite3.Error as e:
+        print(f"✗ Error loading intake trend: {e}")
+        return {"user_id": user_id, "range": range_key, "bucket": "day", "points": []}
+    finally:
+        if conn:
+            conn.close()
+
+def _today_fingerprint(user_id, today):
+    """Today's rollup row; it changes with every intake, including ones logged by other processes"""
+    conn = None
+    try:
+        conn = sqlite3.connect(DB_NAME)
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT entries, total_ml FROM daily_totals WHERE user_id = ? AND date = ?",
+            (user_id, today)
+        )
+        return cursor.fetchone()
+    except sqlite3.Error:
+        return None
+    finally:
+        if conn:
+            conn.close()
+
+def get_intake_trend(user_id, range_key="30d"):
+    """
+    Get daily totals for a range, resampled to weekly, monthly, quarterly or yearly
+    min/mean/max for long ranges. Results are cached per user and range until they
+    log again, for the MAX_CACHED_TRENDS most recently used user and range pairs.
+    """
+    if range_key not in RANGES:
+        raise ValueError(f"Unknown trend range: {range_key}")
+
+    today = datetime.today()
+    key = (user_id, range_key, today.strftime('%Y-%m-%d'))
+    fingerprint = _today_fingerprint(user_id, key[2])
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] == fingerprint:
+            _cache.move_to_end(key)
+            return cached[1]
+        generation = _generation[0]
+
+    trend = _load_trend(user_id, range_key, today)
+    with _cache_lock:
+        # Skip caching if an intake landed while we were reading
+        if generation == _generation[0]:
+            for stale in [k for k in _cache if k[2] != key[2]]:
+                del _cache[stale]
+            _cache[key] = (fingerprint, trend)
+            while len(_cache) > MAX_CACHED_TRENDS:
+                _cache.popitem(last=False)
+    return trend